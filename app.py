@@ -5,11 +5,11 @@ from flask_mail import Mail, Message
 from flask_wtf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne
 from bson.objectid import ObjectId
 from itsdangerous import URLSafeTimedSerializer
 from dotenv import load_dotenv
-import os, stripe, paypalrestsdk, requests
+import os, stripe, paypalrestsdk, requests, threading, time
 from werkzeug.utils import secure_filename
 from datetime import datetime, timedelta
 from functools import wraps
@@ -38,6 +38,23 @@ users = db["users"]
 products = db["products"]
 purchases = db["purchases"]
 coupons = db["coupons"]  # Rabattcodes
+purchases_archive = db["purchases_archive"]  # abgelaufene & heruntergeladene Käufe
+
+# === Archivierung ===
+ARCHIVE_BATCH_SIZE = 500
+ARCHIVE_PAGE_SIZE = 20
+PURCHASE_SWEEP_INTERVAL = int(os.getenv("PURCHASE_SWEEP_INTERVAL", 3600))  # Sekunden, 0 = aus
+
+# Status-Codes → Anzeigetext
+ORDER_STATUS = {
+    "ready": "Bereit",
+    "downloaded": "Bereits heruntergeladen",
+    "expired": "Abgelaufen"
+}
+DOWNLOAD_BLOCKED = {
+    "downloaded": "⚠️ Du hast diese Datei bereits heruntergeladen.",
+    "expired": "⏱ Dieser Download-Link ist abgelaufen."
+}
 
 # === Mail ===
 app.config.update(
@@ -110,6 +127,75 @@ def verify_recaptcha(response_token):
     }).json()
     return res.get("success", False)
 
+def purchase_status(purchase, now):
+    if purchase.get("expires_at") and now > purchase["expires_at"]:
+        return "expired"
+    if purchase.get("downloaded"):
+        return "downloaded"
+    return "ready"
+
+def ensure_indexes():
+    purchases.create_index([("user_id", 1), ("file", 1)])
+    purchases.create_index("expires_at")
+    purchases.create_index("downloaded")
+    purchases_archive.create_index([("user_id", 1), ("timestamp", -1)])
+    purchases_archive.create_index([("user_id", 1), ("file", 1), ("timestamp", -1)])
+    purchases_archive.create_index([("timestamp", -1)])
+
+# Seite `page` (ab 1) des Archivs, neueste zuerst
+def load_archive_page(query, page):
+    rows = list(purchases_archive.find(query)
+                .sort("timestamp", -1)
+                .skip((page - 1) * ARCHIVE_PAGE_SIZE)
+                .limit(ARCHIVE_PAGE_SIZE + 1))
+    for r in rows:
+        r["status"] = ORDER_STATUS.get(r.get("status"), r.get("status"))
+    return rows[:ARCHIVE_PAGE_SIZE], len(rows) > ARCHIVE_PAGE_SIZE
+
+# Verschiebt abgelaufene und heruntergeladene Käufe stapelweise ins Archiv
+def archive_purchases(batch_size=ARCHIVE_BATCH_SIZE):
+    moved = 0
+    while True:
+        now = datetime.utcnow()
+        batch = list(purchases.find(
+            {"$or": [{"downloaded": True}, {"expires_at": {"$lt": now}}]},
+            {"user_id": 1, "email": 1, "file": 1, "timestamp": 1, "downloaded": 1, "expires_at": 1}
+        ).limit(batch_size))
+        if not batch:
+            return moved
+
+        # Upsert per _id, damit ein doppelt laufender Sweeper keine Duplikate erzeugt
+        purchases_archive.bulk_write([
+            ReplaceOne({"_id": p["_id"]}, {
+                "user_id": p.get("user_id"),
+                "email": p.get("email"),
+                "file": p.get("file"),
+                "timestamp": p.get("timestamp"),
+                "status": purchase_status(p, now)
+            }, upsert=True)
+            for p in batch
+        ], ordered=False)
+        purchases.delete_many({"_id": {"$in": [p["_id"] for p in batch]}})
+        moved += len(batch)
+
+def purchase_sweeper():
+    while True:
+        try:
+            archive_purchases()
+        except Exception:
+            app.logger.exception("Archivierung der Käufe fehlgeschlagen")
+        time.sleep(PURCHASE_SWEEP_INTERVAL)
+
+@app.cli.command("init-db")
+def init_db_command():
+    ensure_indexes()
+    print("Indizes angelegt.")
+
+# Für Produktion (gunicorn o. ä.) per Cron/Scheduler aufrufen
+@app.cli.command("archive-purchases")
+def archive_purchases_command():
+    print(f"{archive_purchases()} Käufe archiviert.")
+
 
 # === Startseite ===
 @app.route('/')
@@ -520,17 +606,17 @@ def orders():
     now = datetime.utcnow()
 
     for o in history:
-        expired = o.get("expires_at") and now > o["expires_at"]
-        if expired:
-            o["status"] = "Abgelaufen"
-            o["downloadable"] = False
-        elif o.get("downloaded"):
-            o["status"] = "Bereits heruntergeladen"
-            o["downloadable"] = False
-        else:
-            o["status"] = "Bereit"
-            o["downloadable"] = True
-    return render_template("orders.html", orders=history)
+        status = purchase_status(o, now)
+        o["status"] = ORDER_STATUS[status]
+        o["downloadable"] = status == "ready"
+
+    # Archiv nur auf Anfrage und seitenweise laden
+    archive_page = request.args.get("archiv", 0, type=int)
+    archived, has_more = [], False
+    if archive_page > 0:
+        archived, has_more = load_archive_page({"user_id": current_user.id}, archive_page)
+    return render_template("orders.html", orders=history, archived=archived,
+                           archive_page=archive_page, has_more=has_more)
 
 @app.route("/product-info/<product_id>")
 def product_info(product_id):
@@ -554,16 +640,18 @@ def download(filename):
     })
 
     if not purchase:
-        abort(403)
-
-    # ⏱ Ablauf prüfen
-    if datetime.utcnow() > purchase.get("expires_at", datetime.utcnow()):
-        flash("⏱ Dieser Download-Link ist abgelaufen.", "error")
+        # Bereits archiviert → abgelaufen oder schon heruntergeladen
+        archived = purchases_archive.find_one({"user_id": current_user.id, "file": filename}, {"status": 1},
+                                              sort=[("timestamp", -1)])
+        if not archived:
+            abort(403)
+        flash(DOWNLOAD_BLOCKED.get(archived.get("status"), DOWNLOAD_BLOCKED["downloaded"]), "error")
         return redirect(url_for("orders"))
 
-    # 🔁 Nur einmaliger Download
-    if purchase.get("downloaded"):
-        flash("⚠️ Du hast diese Datei bereits heruntergeladen.", "error")
+    # ⏱ Ablauf prüfen / 🔁 Nur einmaliger Download
+    status = purchase_status(purchase, datetime.utcnow())
+    if status != "ready":
+        flash(DOWNLOAD_BLOCKED[status], "error")
         return redirect(url_for("orders"))
 
     # ✅ Download freigeben und Status speichern
@@ -606,7 +694,12 @@ def admin():
         flash("Produkt erfolgreich hochgeladen.", "success")
         return redirect(url_for("admin"))
 
-    return render_template("admin.html", products=list(products.find()), orders=list(purchases.find()))
+    archive_page = request.args.get("archiv", 0, type=int)
+    archived, has_more = [], False
+    if archive_page > 0:
+        archived, has_more = load_archive_page({}, archive_page)
+    return render_template("admin.html", products=list(products.find()), orders=list(purchases.find()),
+                           archived=archived, archive_page=archive_page, has_more=has_more)
 
 @app.route("/edit-product/<product_id>", methods=["GET", "POST"])
 @login_required
@@ -662,4 +755,9 @@ def inject_globals():
     )
 
 if __name__ == "__main__":
+    # Nur im Reloader-Kindprozess starten, sonst laufen zwei Sweeper
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        ensure_indexes()
+        if PURCHASE_SWEEP_INTERVAL > 0:
+            threading.Thread(target=purchase_sweeper, daemon=True).start()
     app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file